@@ -0,0 +1,388 @@
+# Liam Bessell
+
+"""
+Shared geometry and RAD parsing helpers for the parallel projection scripts.
+
+Everything here operates on honeybee-radiance primitives: polygons are paired
+into quads, their geometry is computed in batched NumPy (or Numba, when it's
+installed) kernels, and RAD files are streamed primitive by primitive.
+"""
+
+import math
+import numpy as np
+
+from honeybee_radiance.geometry import Polygon
+from honeybee_radiance.modifier.material import Plastic
+from honeybee_radiance.modifier.material import Metal
+from honeybee_radiance.modifier.material import Glass
+
+# Numba is optional. When it's installed the per-quad geometry kernel is
+# JIT compiled, otherwise the batched NumPy implementation is used
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Used in floating point error calculations
+SIGMA = 0.0001
+
+# Used for parsing the RAD file
+VALID_MATERIALS = ["plastic", "metal", "glass"]
+
+# Maps each supported material type to the honeybee class that parses it.
+# A dict lookup replaces the string compare per type in the parse loop
+MATERIAL_CLASSES = {"plastic": Plastic, "metal": Metal, "glass": Glass}
+
+# Cache of polygon vertices converted to NumPy arrays, keyed by id(polygon).
+# Polygon instances are locked so the array can't be stored on the object itself.
+vertexArrayCache = {}
+
+def getVertexArray(polygon : Polygon) -> np.ndarray:
+    """
+    Returns the polygon's vertices as an (N, 3) float64 array.
+    The conversion is done once per polygon and cached
+    """
+    key = id(polygon)
+    if key not in vertexArrayCache:
+        vertexArrayCache[key] = np.asarray(polygon.vertices, dtype=np.float64)
+
+    return vertexArrayCache[key]
+
+# Cache of polygon vertices snapped to a SIGMA-sized grid, keyed by id(polygon)
+snappedVerticesCache = {}
+
+def getSnappedVertices(polygon : Polygon) -> []:
+    """
+    Returns the polygon's vertices snapped to a SIGMA-sized grid as a list of
+    integer tuples. Snapping turns the per-element floating point tolerance
+    check into an exact tuple comparison, so vertices can be hashed and compared
+    in constant time
+    """
+    key = id(polygon)
+    if key not in snappedVerticesCache:
+        snapped = np.round(getVertexArray(polygon) / SIGMA).astype(np.int64)
+        snappedVerticesCache[key] = [tuple(row) for row in snapped]
+
+    return snappedVerticesCache[key]
+
+# Cache of the snapped vertices as frozensets, keyed by id(polygon)
+snappedVertexSetCache = {}
+
+def getSnappedVertexSet(polygon : Polygon) -> frozenset:
+    """
+    Returns the polygon's snapped vertices as a frozenset, for constant time
+    shared-vertex tests between polygons
+    """
+    key = id(polygon)
+    if key not in snappedVertexSetCache:
+        snappedVertexSetCache[key] = frozenset(getSnappedVertices(polygon))
+
+    return snappedVertexSetCache[key]
+
+def listsSame(listA : [], listB : []) -> bool:
+    """
+    Returns true if the lists' elements are equal to eachother
+    """
+    if len(listA) != len(listB):
+        return False
+
+    return bool(np.allclose(listA, listB, rtol=0.0, atol=SIGMA))
+
+def crossProduct(vectorA : np.ndarray, vectorB : np.ndarray) -> np.ndarray:
+    """
+    Hand-written cross product for a single pair of 3-vectors. np.cross has
+    noticeable dispatch overhead when called on one small vector at a time;
+    the batched paths still use np.cross over stacked arrays
+    """
+    return np.asarray([vectorA[1] * vectorB[2] - vectorA[2] * vectorB[1],
+                       vectorA[2] * vectorB[0] - vectorA[0] * vectorB[2],
+                       vectorA[0] * vectorB[1] - vectorA[1] * vectorB[0]])
+
+def getQuadNormal(quad : Polygon) -> np.ndarray:
+    """
+    v1        v4
+    +---------+
+    |         |
+    |         |
+    +---------+
+    v2        v3
+
+    Taking the cross product of v2-v1 and v4-v1
+    Since it's a quad, the surface normal is the same throughout
+    """
+    vertices = getVertexArray(quad)
+    normal = crossProduct(vertices[1] - vertices[0], vertices[3] - vertices[0])
+    lengthSquared = np.dot(normal, normal)
+    if lengthSquared == 0:
+        return None
+
+    return normal / math.sqrt(lengthSquared)
+
+def getTriangleNormal(triangle : Polygon) -> np.ndarray:
+    """
+    v1
+    +
+    |\
+    | \
+    |  \
+    +---+
+    v2  v3
+
+    Taking the cross product of v1-v2 and v2-v3
+    """
+    vertices = getVertexArray(triangle)
+    normal = crossProduct(vertices[0] - vertices[1], vertices[2] - vertices[1])
+    lengthSquared = np.dot(normal, normal)
+    if lengthSquared == 0:
+        return None
+
+    return normal / math.sqrt(lengthSquared)
+
+def formsQuad(triangleA : Polygon, triangleB : Polygon) -> bool:
+    """
+    Returns true if these triangles share two vertices.
+    i.e. these two triangles together make up a quad
+    """
+    return len(getSnappedVertexSet(triangleA) & getSnappedVertexSet(triangleB)) >= 2
+
+def formQuad(triangleA : Polygon, triangleB : Polygon) -> Polygon:
+    """
+    Forming a quad out of two complementary triangles
+    """
+    # First we search for the vertex unique to triangle B
+    snappedSetA = getSnappedVertexSet(triangleA)
+    snappedB = getSnappedVertices(triangleB)
+    arrayA = getVertexArray(triangleA)
+    arrayB = getVertexArray(triangleB)
+    uniqueIndex = 0
+    for i in range(len(snappedB)):
+        if snappedB[i] not in snappedSetA:
+            uniqueIndex = i
+            break
+
+    # The unique vertex sits across the edge the triangles share, so inserting
+    # it between the two shared vertices keeps the quad's boundary a simple
+    # cycle. The rows are assembled directly into a preallocated array from the
+    # cached triangle arrays, avoiding per-vertex Python lists
+    snappedA = getSnappedVertices(triangleA)
+    snappedSetB = getSnappedVertexSet(triangleB)
+    quadArray = np.empty((4, 3), dtype=np.float64)
+    if snappedA[0] not in snappedSetB:
+        # Shared edge is v2-v3
+        quadArray[0] = arrayA[0]
+        quadArray[1] = arrayA[1]
+        quadArray[2] = arrayB[uniqueIndex]
+        quadArray[3] = arrayA[2]
+    elif snappedA[1] not in snappedSetB:
+        # Shared edge is v1-v3
+        quadArray[0] = arrayA[0]
+        quadArray[1] = arrayA[1]
+        quadArray[2] = arrayA[2]
+        quadArray[3] = arrayB[uniqueIndex]
+    else:
+        # Shared edge is v1-v2
+        quadArray[0] = arrayA[0]
+        quadArray[1] = arrayB[uniqueIndex]
+        quadArray[2] = arrayA[1]
+        quadArray[3] = arrayA[2]
+
+    # Keep the quad's winding consistent with triangle A. The quad and triangle
+    # normal conventions used here wind in opposite directions, so the cycle is
+    # reversed when the resulting normals disagree
+    quadNormal = crossProduct(quadArray[1] - quadArray[0], quadArray[3] - quadArray[0])
+    if np.dot(quadNormal, getTriangleNormal(triangleA)) < 0:
+        quadArray[1:] = quadArray[:0:-1].copy()
+
+    quad = Polygon(triangleA.identifier, quadArray.tolist())
+    quad.modifier = triangleA.modifier
+    # Seed the cache so the new quad's vertices aren't converted again later
+    vertexArrayCache[id(quad)] = quadArray
+    return quad
+
+def computeQuadGeometryKernel(quadVertices, sigma):
+    """
+    Computes the dimensions, unit normal and view position of every quad in a
+    single fused pass over the stacked (N, 4, 3) vertex array.
+    Returns (dimensions, normals, positions, valid) where valid marks the
+    quads whose normal is non-degenerate.
+    Do not call this directly, use computeQuadGeometry instead
+    """
+    count = quadVertices.shape[0]
+    dimensions = np.empty((count, 3))
+    normals = np.zeros((count, 3))
+    positions = np.empty((count, 3))
+    valid = np.empty(count, dtype=np.bool_)
+    for k in range(count):
+        vertices = quadVertices[k]
+        for d in range(3):
+            minimum = vertices[0, d]
+            maximum = vertices[0, d]
+            for i in range(1, 4):
+                if vertices[i, d] < minimum:
+                    minimum = vertices[i, d]
+                if vertices[i, d] > maximum:
+                    maximum = vertices[i, d]
+            dimensions[k, d] = maximum - minimum
+            positions[k, d] = minimum + (maximum - minimum) / 2
+
+        # The cross product is inlined because Numba's nopython mode
+        # doesn't support np.cross
+        aX = vertices[1, 0] - vertices[0, 0]
+        aY = vertices[1, 1] - vertices[0, 1]
+        aZ = vertices[1, 2] - vertices[0, 2]
+        bX = vertices[3, 0] - vertices[0, 0]
+        bY = vertices[3, 1] - vertices[0, 1]
+        bZ = vertices[3, 2] - vertices[0, 2]
+        normalX = aY * bZ - aZ * bY
+        normalY = aZ * bX - aX * bZ
+        normalZ = aX * bY - aY * bX
+        length = (normalX * normalX + normalY * normalY + normalZ * normalZ) ** 0.5
+        valid[k] = length != 0
+        if length == 0:
+            continue
+
+        normals[k, 0] = normalX / length
+        normals[k, 1] = normalY / length
+        normals[k, 2] = normalZ / length
+
+        # On the quad's flat dimension every vertex has the same value, so the
+        # view position is offset from the first vertex along the normal instead
+        for d in range(3):
+            if dimensions[k, d] <= sigma:
+                positions[k, d] = vertices[0, d] + 0.1 * normals[k, d]
+
+    return dimensions, normals, positions, valid
+
+if NUMBA_AVAILABLE:
+    computeQuadGeometryKernel = njit(cache=True)(computeQuadGeometryKernel)
+
+def computeQuadGeometry(quadVertices : np.ndarray) -> ():
+    """
+    Computes the dimensions, unit normal and view position for every quad.
+    quadVertices is the stacked (N, 4, 3) array of quad vertices.
+    Returns (dimensions, normals, positions, valid)
+    """
+    if NUMBA_AVAILABLE:
+        return computeQuadGeometryKernel(quadVertices, SIGMA)
+
+    minimums = quadVertices.min(axis=1)
+    dimensions = quadVertices.max(axis=1) - minimums
+    normals = np.cross(quadVertices[:, 1] - quadVertices[:, 0], quadVertices[:, 3] - quadVertices[:, 0])
+    normalLengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    valid = normalLengths[:, 0] != 0
+    normals = normals / np.where(normalLengths == 0, 1.0, normalLengths)
+    positions = np.where(dimensions > SIGMA, minimums + dimensions / 2, quadVertices[:, 0] + 0.1 * normals)
+    return dimensions, normals, positions, valid
+
+def pairTrianglesIntoQuads(triangles : []) -> ():
+    """
+    Pairs complementary triangles into quads using a shared-edge hash.
+    Every triangle registers its three edges, keyed by the snapped tuples of
+    the edge's endpoints. Two coplanar triangles incident to the same edge
+    form a quad. Unlike a sequential scan this finds the pairs no matter how
+    the triangles are ordered in the RAD file.
+    Returns the list of formed quads and the list of unpaired triangles
+    """
+    if len(triangles) == 0:
+        return [], []
+
+    # Compute every triangle's normal with one batched cross product up front,
+    # instead of one getTriangleNormal call per candidate pair below
+    triangleVertices = np.stack([getVertexArray(triangle) for triangle in triangles])
+    triangleNormals = np.cross(triangleVertices[:, 0] - triangleVertices[:, 1], triangleVertices[:, 2] - triangleVertices[:, 1])
+    normalLengths = np.linalg.norm(triangleNormals, axis=1, keepdims=True)
+    triangleValid = normalLengths[:, 0] != 0
+    triangleNormals = triangleNormals / np.where(normalLengths == 0, 1.0, normalLengths)
+
+    edgeToTriangles = {}
+    for i in range(len(triangles)):
+        snapped = getSnappedVertices(triangles[i])
+        for j in range(3):
+            edge = frozenset((snapped[j], snapped[(j + 1) % 3]))
+            edgeToTriangles.setdefault(edge, []).append(i)
+
+    quads = []
+    paired = set()
+    for incident in edgeToTriangles.values():
+        if len(incident) != 2:
+            continue
+
+        indexA, indexB = incident
+        if indexA in paired or indexB in paired:
+            continue
+
+        # Only pair triangles lying in the same plane. The absolute value keeps
+        # pairs whose windings (and therefore normals) are flipped
+        if not triangleValid[indexA] or not triangleValid[indexB]:
+            continue
+        if abs(np.dot(triangleNormals[indexA], triangleNormals[indexB])) < 1 - SIGMA:
+            continue
+
+        quads.append(formQuad(triangles[indexA], triangles[indexB]))
+        paired.add(indexA)
+        paired.add(indexB)
+
+    trianglesMissed = [triangles[i] for i in range(len(triangles)) if i not in paired]
+    return quads, trianglesMissed
+
+def tokenizeRadFile(filePath : str):
+    """
+    Yields the whitespace-separated tokens of the RAD file one line at a time,
+    skipping blank lines, comments and commands
+    """
+    with open(filePath, "r") as radFile:
+        for line in radFile:
+            line = line.strip()
+            if len(line) == 0 or line.startswith("#") or line.startswith("!"):
+                continue
+
+            for token in line.split():
+                yield token
+
+def iterPrimitives(filePath : str):
+    """
+    Yields (type, identifier, argumentTokens) for each primitive in the RAD
+    file that the script understands. The file is consumed in a single
+    streaming pass over its tokens instead of materializing every primitive as
+    a string block and re-parsing it. argumentTokens holds the real argument
+    group, which is the only group any of the supported primitives uses
+    """
+    tokens = tokenizeRadFile(filePath)
+    for modifier in tokens:
+        try:
+            primitiveType = next(tokens)
+            identifier = next(tokens)
+            # Every Radiance primitive carries three argument groups, each
+            # prefixed by its length; unsupported primitives are still consumed
+            # so the token stream stays aligned
+            values = []
+            for i in range(3):
+                count = int(next(tokens))
+                values.append([next(tokens) for j in range(count)])
+        except (StopIteration, ValueError):
+            print("Error: '{0}' ended in the middle of a primitive, file may be malformed.".format(filePath))
+            return
+
+        if primitiveType != "polygon" and primitiveType not in MATERIAL_CLASSES:
+            print("Error: Can't parse '{0}' from RAD file. If this is a material try manually adding it to the script, else ignore.".format(identifier))
+            continue
+
+        yield primitiveType, identifier, values[2]
+
+def buildPolygon(identifier : str, coordinateTokens : [], modifier=None) -> Polygon:
+    """
+    Builds a Polygon directly from its coordinate tokens, skipping the
+    primitive-dict intermediate and its re-parse of the vertex floats
+    """
+    vertices = np.fromiter(map(float, coordinateTokens), dtype=np.float64).reshape(-1, 3)
+    polygon = Polygon(identifier, vertices.tolist(), modifier=modifier)
+    # Seed the cache so the vertices aren't converted to an array again later
+    vertexArrayCache[id(polygon)] = vertices
+    return polygon
+
+def buildMaterial(primitiveType : str, identifier : str, argumentTokens : []):
+    """
+    Builds a material modifier directly from its argument tokens
+    """
+    return MATERIAL_CLASSES[primitiveType](identifier, *map(float, argumentTokens))